@@ -12,8 +12,23 @@
  -f: input asg config file
  -p <int>: specifies interval over which to print ASG's with active instances.
            If not specified, default is '2'.
+ -s: restore the ASG's in waves from the capacity snapshot, bringing each
+     wave's DesiredCapacity up and waiting for its instances to be InService
+     before starting the next wave. Alarm driven scaling is suspended for the
+     wave while it ramps.
+ -r: only restore the ASG's from an existing asg_config.json snapshot
+     without zeroing them first.
+ -w <int>: number of ASG's restored per wave. If not specified, default is '1'.
+ --ramp <int>: max number of instances added to each ASG per step within a
+               wave. If not specified, default is '0' (full capacity at once).
+ --priority <str>: comma separated ASG name substrings restored first, in order.
+                   If not specified, default is 'grq,mozart'.
+ -t <int>: seconds to wait for a wave's instances to be InService before it stops
+           ramping and moves on to the next wave, 0 for no limit. If not
+           specified, default is '900'.
 
  Example usage:  python zero_all_asgs.py -p 3
+                 python zero_all_asgs.py -s -w 2 --ramp 5 --priority grq,mozart,factotum
 '''
 
 import boto3
@@ -36,8 +51,10 @@ def set_asgs_to_zero():
     f = open("asg_config.json", "w")
     data = {}
 
-    response = client.describe_auto_scaling_groups()
-    asgs = response['AutoScalingGroups']
+    asgs = []
+    paginator = client.get_paginator('describe_auto_scaling_groups')
+    for response in paginator.paginate():
+        asgs.extend(response['AutoScalingGroups'])
 
     for asg in asgs:
         # Get asg name
@@ -57,7 +74,7 @@ def set_asgs_to_zero():
             print("...setting MaxSize to 0")
 
         if (asg['DesiredCapacity'] is not 0):
-            #data[asg_name].append({'DesiredCapacity':asg['DesiredCapacity']})
+            data[asg_name].append({'DesiredCapacity':asg['DesiredCapacity']})
             client.update_auto_scaling_group(AutoScalingGroupName=asg_name, DesiredCapacity=0)
             print("...setting DesiredCapacity to 0")
 
@@ -120,6 +137,153 @@ def set_asgs_to_defaults():
                     client.update_auto_scaling_group(AutoScalingGroupName=asg_name, MinSize=minSize)
                     print("Set MinSize to", minSize)
                   
+'''
+Reads the capacity snapshot from the config file into a dict of asg name to
+MinSize, MaxSize, and DesiredCapacity values. Values missing from the snapshot
+were zero, except DesiredCapacity which falls back to MinSize for snapshots
+taken before it was recorded.
+'''
+def load_capacity_snapshot(config="asg_config.json"):
+    f = open(config, "r")
+    data = json.load(f)
+    f.close()
+
+    snapshot = {}
+    for asg_name, param in data.items():
+        capacity = {MIN_SIZE: 0, MAX_SIZE: 0}
+        for obj in param:
+            capacity.update(obj)
+        capacity.setdefault(DESIRED_CAPACITY, capacity[MIN_SIZE])
+        snapshot[asg_name] = capacity
+    return snapshot
+
+'''
+Orders asg names so that those matching the earliest priority substring come
+first, keeping the remaining asg's in name order.
+'''
+def order_asgs(asg_names, priority):
+    def rank(asg_name):
+        for i, p in enumerate(priority):
+            if p.lower() in asg_name.lower():
+                return (i, asg_name)
+        return (len(priority), asg_name)
+    return sorted(asg_names, key=rank)
+
+'''
+Returns the describe_auto_scaling_groups entry for each of the given ASG's.
+'''
+def describe_asgs(asg_names):
+    asgs = {}
+    for i in range(0, len(asg_names), 50):
+        response = client.describe_auto_scaling_groups(AutoScalingGroupNames=asg_names[i:i + 50])
+        for asg in response['AutoScalingGroups']:
+            asgs[asg['AutoScalingGroupName']] = asg
+    return asgs
+
+'''
+Returns the number of InService instances for each of the given ASG's.
+'''
+def count_in_service(asg_names):
+    counts = {}
+    for asg_name, asg in describe_asgs(asg_names).items():
+        counts[asg_name] = len([x for x in asg['Instances'] if x['LifecycleState'] == 'InService'])
+    return counts
+
+'''
+Print list of ASG's still short of their desired InService count until all
+have caught up or the deadline (epoch seconds, None for none) has passed.
+'''
+def wait_for_asgs_in_service(desired, period, deadline):
+    while(True):
+        in_service = count_in_service(list(desired.keys()))
+        pending = sorted([asg_name for asg_name in desired if in_service.get(asg_name, 0) < desired[asg_name]])
+
+        if (len(pending) <= 0):
+            return True
+
+        if (deadline is not None and time.time() > deadline):
+            print("\nTimed out waiting for the following ASG's, moving on:")
+            print('\n'.join(pending))
+            return False
+
+        print("\nWaiting for instances from the following ASG's to be InService:")
+        for asg_name in pending:
+            print("%s: %d/%d" % (asg_name, in_service.get(asg_name, 0), desired[asg_name]))
+        time.sleep(int(period))
+
+'''
+Restores maxsize, desired capacity, and minsize from the capacity snapshot in
+waves of wave_size ASG's, ordered by priority. Within a wave DesiredCapacity is
+raised from its live value towards the snapshot by at most ramp instances per
+step (all at once if ramp is 0), waiting for each step's instances to be
+InService. Alarm driven scaling is suspended while a wave ramps so scaling
+policies can't skip the steps. If the wave isn't InService within timeout
+seconds (0 for none), ramping stops for that wave and the next one starts.
+'''
+def set_asgs_to_defaults_staged(wave_size, ramp, priority, period, timeout):
+    snapshot = load_capacity_snapshot()
+    asg_names = order_asgs(list(snapshot.keys()), priority)
+    waves = [asg_names[i:i + wave_size] for i in range(0, len(asg_names), wave_size)]
+
+    for n, wave in enumerate(waves):
+        print("\n***********************************************")
+        print("\nRestoring wave %d of %d: %s" % (n + 1, len(waves), ', '.join(wave)))
+        deadline = time.time() + timeout if (timeout > 0) else None
+
+        # Start from the live capacity, the groups may not have been drained or
+        # may have been partly restored by a previous run
+        live = describe_asgs(wave)
+        for asg_name in [x for x in wave if x not in live]:
+            print("WARNING: %s no longer exists. Skipping..." % asg_name)
+        wave = [x for x in wave if x in live]
+
+        # Suspend alarm driven scaling while ramping, only resuming it on the
+        # groups where it wasn't already suspended
+        suspended = [x for x in wave if 'AlarmNotification' not in [p['ProcessName'] for p in live[x]['SuspendedProcesses']]]
+        for asg_name in suspended:
+            client.suspend_processes(AutoScalingGroupName=asg_name, ScalingProcesses=['AlarmNotification'])
+        try:
+            # Widen min/max so that every step stays within the group's bounds
+            for asg_name in wave:
+                minSize = min(live[asg_name][MIN_SIZE], snapshot[asg_name][MIN_SIZE])
+                maxSize = max(live[asg_name][DESIRED_CAPACITY], snapshot[asg_name][MAX_SIZE])
+                client.update_auto_scaling_group(AutoScalingGroupName=asg_name, MinSize=minSize, MaxSize=maxSize)
+                print("%s: set MinSize to %d, MaxSize to %d" % (asg_name, minSize, maxSize))
+
+            # Step desired capacity up to the snapshot values
+            current = dict((asg_name, live[asg_name][DESIRED_CAPACITY]) for asg_name in wave)
+            target = dict((asg_name, snapshot[asg_name][DESIRED_CAPACITY]) for asg_name in wave)
+            while ([x for x in wave if current[x] < target[x]]):
+                for asg_name in [x for x in wave if current[x] < target[x]]:
+                    if (ramp > 0):
+                        desiredCapacity = min(current[asg_name] + ramp, target[asg_name])
+                    else:
+                        desiredCapacity = target[asg_name]
+                    client.update_auto_scaling_group(AutoScalingGroupName=asg_name, DesiredCapacity=desiredCapacity)
+                    print("%s: set DesiredCapacity to %d" % (asg_name, desiredCapacity))
+                    current[asg_name] = desiredCapacity
+                if (not wait_for_asgs_in_service(current, period, deadline)):
+                    for asg_name in [x for x in wave if current[x] < target[x]]:
+                        print("%s: stopped ramping at DesiredCapacity %d of %d" % (asg_name, current[asg_name], target[asg_name]))
+                    break
+                # Pick up any changes made to the groups while waiting
+                live = describe_asgs(wave)
+                current = dict((asg_name, live[asg_name][DESIRED_CAPACITY]) for asg_name in wave)
+
+            # MinSize is capped at the reached capacity so a stopped ramp isn't forced to its target
+            for asg_name in wave:
+                minSize = min(snapshot[asg_name][MIN_SIZE], current[asg_name])
+                maxSize = snapshot[asg_name][MAX_SIZE]
+                client.update_auto_scaling_group(AutoScalingGroupName=asg_name, MinSize=minSize, MaxSize=maxSize)
+                print("%s: set MinSize to %d, MaxSize to %d" % (asg_name, minSize, maxSize))
+        finally:
+            for asg_name in suspended:
+                client.resume_processes(AutoScalingGroupName=asg_name, ScalingProcesses=['AlarmNotification'])
+
+    print("\n***********************************************")
+    print("\nAll asg's restored.")
+    print("\n***********************************************")
+
 '''
 Sets asg min, max, and/or desired capacity values from config
 '''    
@@ -155,12 +319,23 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--period", default=2, help="Interval in seconds to print list of ASG's with active instances.")
     parser.add_argument("-f", "--f", help="Input asg config file containing desired values.")
+    parser.add_argument("-s", "--staged", action="store_true", help="Restore ASG's in waves, waiting for each wave's instances to be InService.")
+    parser.add_argument("-r", "--restore", action="store_true", help="Only restore ASG's from an existing asg_config.json snapshot.")
+    parser.add_argument("-w", "--wave-size", type=int, default=1, help="Number of ASG's restored per wave.")
+    parser.add_argument("--ramp", type=int, default=0, help="Max instances added to each ASG per step, 0 for full capacity at once.")
+    parser.add_argument("--priority", default="grq,mozart", help="Comma separated ASG name substrings restored first, in order.")
+    parser.add_argument("-t", "--timeout", type=int, default=900, help="Seconds to wait for a wave's instances to be InService before it stops ramping, 0 for no limit.")
     args = parser.parse_args()
 
     if (args.f is not None):
         # Set asg values to those specified in config
         set_asg_from_config(args.f)
     else:
-        set_asgs_to_zero()
-        wait_for_asgs_to_zero(args.period)
-        set_asgs_to_defaults()
+        if (not args.restore):
+            set_asgs_to_zero()
+            wait_for_asgs_to_zero(args.period)
+        if (args.staged):
+            priority = [p.strip() for p in args.priority.split(",") if p.strip()]
+            set_asgs_to_defaults_staged(max(args.wave_size, 1), args.ramp, priority, args.period, args.timeout)
+        else:
+            set_asgs_to_defaults()
@@ -6,6 +6,8 @@ Validates whether all acquisitions are localized over an input AOI and track
 from __future__ import print_function
 import os
 import re
+import copy
+import time
 import json
 import argparse
 import urllib3
@@ -14,10 +16,15 @@ from datetime import datetime
 import dateutil.parser
 import shapely.wkt
 from shapely.geometry import Polygon, MultiPolygon
+from multiprocessing.pool import ThreadPool
 from hysds.celery import app
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+INDEX_CACHE_FILE = "es_index_cache.json"
+INDEX_CACHE_TTL = 3600 # seconds
+MAX_THREADS = 8
+
 scihub_results = dict()
 es_results = dict()
 latest_slcs = list()
@@ -162,13 +169,11 @@ def get_es_objects(aoi, acq_index, track_number):
     starttime = aoi.get('_source', {}).get('starttime')
     endtime = aoi.get('_source', {}).get('endtime')
     location = aoi.get('_source', {}).get('location')
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, acq_index)
     grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": {"shape":location}}},
                                       "filter":{"bool":{"must":[{"term":{"metadata.track_number":track_number}},
                                                                 {"range":{"endtime":{"from":starttime}}},
                                                                 {"range":{"starttime":{"to":endtime}}}]}}}},"from":0,"size":1000}
-    results = query_es(grq_url, grq_query)
+    results = search_es(acq_index, grq_query)
     slc_id_list = [x.get('_id') for x in results]
     for x in results:
         slc_id_list.append(x.get("_id"))
@@ -181,10 +186,8 @@ def get_aoi(aoi_id, aoi_index):
     '''
     retrieves the AOI from ES
     '''
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, aoi_index)
     es_query = {"query":{"bool":{"must":[{"term":{"id.raw":aoi_id}}]}}}
-    result = query_es(grq_url, es_query)
+    result = search_es(aoi_index, es_query)
     if len(result) < 1:
         raise Exception('Found no results for AOI: {}'.format(aoi_id))
     return result[0]
@@ -194,15 +197,77 @@ def get_acq(_id, _index="grq_v*_acquisition-s1-iw_slc"):
     '''
     retrieves the AOI from ES
     '''
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, _index)
     es_query = {"query":{"bool":{"must":[{"term":{"_id":_id}}]}}}
-    result = query_es(grq_url, es_query)
+    result = search_es(_index, es_query)
     if len(result) < 1:
         raise Exception('Found no results for AOI: {}'.format(_id))
     return result[0]
 
 
+def search_es(index_pattern, es_query):
+    '''
+    Runs the query over each live index matching the pattern
+    in parallel & returns the merged result
+    '''
+    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_urls = ['{0}/es/{1}/_search'.format(grq_ip, index) for index in resolve_indices(grq_ip, index_pattern)]
+    if len(grq_urls) == 1:
+        return query_es(grq_urls[0], es_query)
+    pool = ThreadPool(min(len(grq_urls), MAX_THREADS))
+    try:
+        results = pool.map(lambda grq_url: query_es(grq_url, copy.deepcopy(es_query)), grq_urls)
+    finally:
+        pool.close()
+    return [hit for result in results for hit in result]
+
+
+def resolve_indices(grq_ip, index_pattern):
+    '''
+    Resolves the index pattern to the open indices that hold documents,
+    caching the result in INDEX_CACHE_FILE for INDEX_CACHE_TTL seconds
+    '''
+    if '*' not in index_pattern and ',' not in index_pattern:
+        # concrete index or alias, nothing to resolve
+        return [index_pattern]
+    key = '{0}|{1}'.format(grq_ip, index_pattern)
+    cache = load_json(INDEX_CACHE_FILE)
+    cached = cache.get(key)
+    if cached is not None and time.time() - cached.get('time', 0) < INDEX_CACHE_TTL:
+        return cached.get('indices')
+    response = requests.get('{0}/es/{1}/_stats/docs'.format(grq_ip, index_pattern), params={'expand_wildcards': 'open'}, timeout=60, verify=False)
+    response.raise_for_status()
+    stats = response.json().get('indices', {})
+    indices = sorted([index for index, stat in stats.items() if stat.get('primaries', {}).get('docs', {}).get('count', 0) > 0])
+    if not indices:
+        # nothing to narrow down to, let ES resolve the pattern
+        indices = [index_pattern]
+    cache[key] = {'time': time.time(), 'indices': indices}
+    write_json(INDEX_CACHE_FILE, cache)
+    return indices
+
+
+def load_json(json_file):
+    '''
+    Reads the json file, treating a missing or unreadable file as empty
+    '''
+    try:
+        with open(json_file, 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_json(json_file, data):
+    '''
+    Writes the json file through a temp file so an interrupted write never leaves it truncated
+    '''
+    tmp_file = '{0}.{1}.tmp'.format(json_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, json_file)
+
+
 def query_es(grq_url, es_query):
     '''
     Runs the query through Elasticsearch, iterates until
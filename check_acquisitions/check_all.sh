@@ -10,6 +10,6 @@ do
     echo "CHECKING $aoi ACQUISITIONS..."
     ./check_acquisition_completeness.py --aoi $aoi --track $track
     echo "CHECKING $aoi IPFS..."
-    ./check_ipf_completeness.py --aoi $aoi --track $track
+    ./check_ipf_completeness.py --aoi $aoi --track $track --since_last_run
     echo ""
 done
@@ -6,24 +6,66 @@ Thumbs up/down on whether all ipfs are filled over an input AOI
 from __future__ import print_function
 import os
 import re
+import copy
+import time
 import json
 import argparse
 import urllib3
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 import dateutil.parser
+from multiprocessing.pool import ThreadPool
 from hysds.celery import app
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def main(aoi_id, aoi_index, acq_index, track_number):
+INDEX_CACHE_FILE = "es_index_cache.json"
+INDEX_CACHE_TTL = 3600 # seconds
+MAX_THREADS = 8
+
+WATERMARK_FILE = "ipf_watermarks.json"
+WATERMARK_OVERLAP = 3600 # seconds, covers ES refresh lag & GRQ clock skew
+
+def main(aoi_id, aoi_index, acq_index, track_number, since_last_run=False, watermark_file=WATERMARK_FILE):
     '''main loop.'''
     #get aoi info
     aoi = get_aoi(aoi_id, aoi_index)
     #get local acquisitions
     print('querying es...')
-    es_ids = get_es_objects(aoi, acq_index, track_number)
-    print('found {} total es ids.'.format(len(es_ids)))    
+    # back the watermark off so acquisitions indexed around the run start, or stamped
+    # by a lagging GRQ clock, are picked up again next run
+    run_time = (datetime.utcnow() - timedelta(seconds=WATERMARK_OVERLAP)).strftime('%Y-%m-%dT%H:%M:%S')
+    starttime = aoi.get('_source', {}).get('starttime')
+    endtime = aoi.get('_source', {}).get('endtime')
+    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    indices = resolve_indices(grq_ip, acq_index)
+    watermarks = load_json(watermark_file)
+    key = get_watermark_key(aoi_id, track_number, acq_index)
+    watermark = watermarks.get(key)
+    if watermark is not None and (watermark.get('starttime'), watermark.get('endtime')) != (starttime, endtime):
+        if since_last_run:
+            print('AOI time range changed since the last run, running full sweep...')
+        watermark = None
+    elif watermark is not None and watermark.get('indices') != indices:
+        if since_last_run:
+            print('acquisition indices changed since the last run, running full sweep...')
+        watermark = None
+    if since_last_run and watermark is not None:
+        print('only checking acquisitions created since {}...'.format(watermark.get('last_run')))
+        es_ids = get_es_objects(aoi, acq_index, track_number, since=watermark.get('last_run'))
+        print('found {} new es ids.'.format(len(es_ids)))
+        outstanding = watermark.get('outstanding', [])
+        still_open = get_open_ids(acq_index, outstanding)
+        print('{} of {} previously outstanding es ids are still missing ipfs.'.format(len(still_open), len(outstanding)))
+        es_ids = sorted(set(es_ids) | set(still_open))
+    else:
+        if since_last_run and key not in watermarks:
+            print('no watermark found for {}, running full sweep...'.format(key))
+        es_ids = get_es_objects(aoi, acq_index, track_number)
+    print('found {} total es ids.'.format(len(es_ids)))
+    #store the watermark & outstanding set for the next run
+    watermarks[key] = {"last_run": run_time, "starttime": starttime, "endtime": endtime, "indices": indices, "outstanding": es_ids}
+    write_json(watermark_file, watermarks)
     #print results
     if not es_ids:
         print('There are no missing ipfs!')
@@ -31,30 +73,102 @@ def main(aoi_id, aoi_index, acq_index, track_number):
         print('Missing ipfs count: {}'.format(len(es_ids)))
         print('Acquisitions:\n{}'.format('\n'.join(es_ids)))
 
-def get_es_objects(aoi, acq_index, track_number):
+def get_es_objects(aoi, acq_index, track_number, since=None):
     starttime = aoi.get('_source', {}).get('starttime')
     endtime = aoi.get('_source', {}).get('endtime')
     location = aoi.get('_source', {}).get('location')
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, acq_index)
     grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": {"shape":location}}},"filter":{"bool":{"must":[{"term":{"metadata.track_number":track_number}},{"range":{"endtime":{"from":starttime}}},{"range":{"starttime":{"to":endtime}}}],"must_not":[{"term":{"metadata.tags":"deprecated"}},{"exists":{"field":"metadata.processing_version.raw"}}]}}}},"from":0,"size":1000}
+    if since is not None:
+        grq_query["query"]["filtered"]["filter"]["bool"]["must"].append({"range":{"creation_timestamp":{"gt":since}}})
     #print(json.dumps(grq_query))
-    results = query_es(grq_url, grq_query)
-    slc_id_list = [x.get('_id') for x in results]
+    results = search_es(acq_index, grq_query)
+    # an acquisition can be in more than one index version, only list it once
+    slc_id_list = sorted(set(x.get('_id') for x in results))
     return slc_id_list
 
+def get_open_ids(acq_index, id_list):
+    '''
+    re-checks the given acquisition ids, returning those that are still missing ipfs
+    '''
+    if not id_list:
+        return []
+    grq_query = {"query":{"filtered":{"filter":{"bool":{"must":[{"ids":{"values":id_list}}],"must_not":[{"term":{"metadata.tags":"deprecated"}},{"exists":{"field":"metadata.processing_version.raw"}}]}}}},"from":0,"size":1000}
+    results = search_es(acq_index, grq_query)
+    return sorted(set(x.get('_id') for x in results))
+
+def get_watermark_key(aoi_id, track_number, acq_index):
+    return '{}_{}_{}'.format(aoi_id, track_number, acq_index)
+
 def get_aoi(aoi_id, aoi_index):
     '''
     retrieves the AOI from ES
     '''
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, aoi_index)
     es_query = {"query":{"bool":{"must":[{"term":{"id.raw":aoi_id}}]}}}
-    result = query_es(grq_url, es_query)
+    result = search_es(aoi_index, es_query)
     if len(result) < 1:
         raise Exception('Found no results for AOI: {}'.format(aoi_id))
     return result[0]
 
+def search_es(index_pattern, es_query):
+    '''
+    Runs the query over each live index matching the pattern
+    in parallel & returns the merged result
+    '''
+    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_urls = ['{0}/es/{1}/_search'.format(grq_ip, index) for index in resolve_indices(grq_ip, index_pattern)]
+    if len(grq_urls) == 1:
+        return query_es(grq_urls[0], es_query)
+    pool = ThreadPool(min(len(grq_urls), MAX_THREADS))
+    try:
+        results = pool.map(lambda grq_url: query_es(grq_url, copy.deepcopy(es_query)), grq_urls)
+    finally:
+        pool.close()
+    return [hit for result in results for hit in result]
+
+def resolve_indices(grq_ip, index_pattern):
+    '''
+    Resolves the index pattern to the open indices that hold documents,
+    caching the result in INDEX_CACHE_FILE for INDEX_CACHE_TTL seconds
+    '''
+    if '*' not in index_pattern and ',' not in index_pattern:
+        # concrete index or alias, nothing to resolve
+        return [index_pattern]
+    key = '{0}|{1}'.format(grq_ip, index_pattern)
+    cache = load_json(INDEX_CACHE_FILE)
+    cached = cache.get(key)
+    if cached is not None and time.time() - cached.get('time', 0) < INDEX_CACHE_TTL:
+        return cached.get('indices')
+    response = requests.get('{0}/es/{1}/_stats/docs'.format(grq_ip, index_pattern), params={'expand_wildcards': 'open'}, timeout=60, verify=False)
+    response.raise_for_status()
+    stats = response.json().get('indices', {})
+    indices = sorted([index for index, stat in stats.items() if stat.get('primaries', {}).get('docs', {}).get('count', 0) > 0])
+    if not indices:
+        # nothing to narrow down to, let ES resolve the pattern
+        indices = [index_pattern]
+    cache[key] = {'time': time.time(), 'indices': indices}
+    write_json(INDEX_CACHE_FILE, cache)
+    return indices
+
+def load_json(json_file):
+    '''
+    Reads the json file, treating a missing or unreadable file as empty
+    '''
+    try:
+        with open(json_file, 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def write_json(json_file, data):
+    '''
+    Writes the json file through a temp file so an interrupted write never leaves it truncated
+    '''
+    tmp_file = '{0}.{1}.tmp'.format(json_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, json_file)
+
 def query_es(grq_url, es_query):
     '''
     Runs the query through Elasticsearch, iterates until
@@ -94,8 +208,10 @@ def parser():
     parse.add_argument("--track", help="track number", dest='track_number', required=True)
     parse.add_argument("--aoi_index", help="AOI Index", default= "grq_*_area_of_interest", dest='aoi_index', required=False)
     parse.add_argument("---acq_index", help="Acquisition index", default="grq_*_acquisition-s1-iw_slc", dest="acq_index", required=False)
+    parse.add_argument("--since_last_run", help="Only check acquisitions created since the last run & re-check the previously missing ones", action="store_true", dest="since_last_run", required=False)
+    parse.add_argument("--watermark_file", help="File storing the last run time & missing ipfs for each AOI/track", default=WATERMARK_FILE, dest="watermark_file", required=False)
     return parse
 
 if __name__ == '__main__':
     args = parser().parse_args()
-    main(args.aoi_name, args.aoi_index, args.acq_index, int(args.track_number))
+    main(args.aoi_name, args.aoi_index, args.acq_index, int(args.track_number), args.since_last_run, args.watermark_file)
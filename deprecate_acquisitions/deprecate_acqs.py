@@ -1,3 +1,6 @@
+import os
+import json
+import time
 import logging
 import elasticsearch
 from hysds.celery import app
@@ -21,11 +24,91 @@ _index = None
 _type = None
 ES = elasticsearch.Elasticsearch(es_url)
 
+ACQ_INDEX = "grq_*_acquisition-s1-iw_slc"
+INDEX_CACHE_FILE = "es_index_cache.json"
+INDEX_CACHE_TTL = 3600  # seconds
 
-def update_document(_id):
+
+def resolve_indices(index_pattern):
+    """
+    Resolve an index pattern to the open indices holding documents
+    :param index_pattern: index name, alias or wildcard pattern
+    :return: list of index names, cached in INDEX_CACHE_FILE for INDEX_CACHE_TTL seconds
+    """
+    if "*" not in index_pattern and "," not in index_pattern:
+        # concrete index or alias, nothing to resolve
+        return [index_pattern]
+    key = "{}|{}".format(es_url, index_pattern)
+    cache = load_json(INDEX_CACHE_FILE)
+    cached = cache.get(key)
+    if cached is not None and time.time() - cached.get("time", 0) < INDEX_CACHE_TTL:
+        return cached.get("indices")
+    stats = ES.indices.stats(index=index_pattern, metric="docs", expand_wildcards="open").get("indices", {})
+    indices = sorted([index for index, stat in stats.items()
+                      if stat.get("primaries", {}).get("docs", {}).get("count", 0) > 0])
+    if not indices:
+        # nothing to narrow down to, let ES resolve the pattern
+        indices = [index_pattern]
+    cache[key] = {"time": time.time(), "indices": indices}
+    write_json(INDEX_CACHE_FILE, cache)
+    return indices
+
+
+def load_json(json_file):
+    """
+    Read a json file, treating a missing or unreadable file as empty
+    :param json_file: path to the json file
+    :return: dict
+    """
+    try:
+        with open(json_file, "r") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return dict()
+    return data if isinstance(data, dict) else dict()
+
+
+def write_json(json_file, data):
+    """
+    Write a json file through a temp file so an interrupted write never leaves it truncated
+    :param json_file: path to the json file
+    :param data: dict to write
+    """
+    tmp_file = "{}.{}.tmp".format(json_file, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, json_file)
+
+
+def get_document_indices(ids, chunk_size=1000):
+    """
+    Find the concrete indices holding each document
+    :param ids: list of document ids
+    :param chunk_size: number of ids to look up per request
+    :return: dict of id to list of indices
+    """
+    indices = ",".join(resolve_indices(ACQ_INDEX))
+    doc_indices = dict()
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        offset = 0
+        # page through the hits, an id can have a copy in more than one index
+        while True:
+            body = {"query": {"ids": {"values": chunk}}, "_source": False, "from": offset, "size": chunk_size}
+            hits = ES.search(index=indices, body=body)["hits"]["hits"]
+            for hit in hits:
+                doc_indices.setdefault(hit["_id"], []).append(hit["_index"])
+            if len(hits) < chunk_size:
+                break
+            offset += len(hits)
+    return doc_indices
+
+
+def update_document(_id, index):
     """
     Update the ES document with new information
     :param _id: id of product delivered to ASF
+    :param index: concrete index holding the document
     :param delivery_time: delivery time to ASF to stamp to delivered product
     :param ingest_time: ingestion time to ASF to stamp to delivered product
     :param delivery_status: status of delivery to stamp to delivered product
@@ -46,7 +129,7 @@ def update_document(_id):
     doc["metadata"] = metadata
     new_doc["doc"] = doc
 
-    ES.update(index="grq_v2.0_acquisition-s1-iw_slc", doc_type="acquisition-S1-IW_SLC", id=_id, body=new_doc)
+    ES.update(index=index, doc_type="acquisition-S1-IW_SLC", id=_id, body=new_doc)
     return
 
 
@@ -55,7 +138,12 @@ if __name__ == "__main__":
     Main program that find IPF version for acquisition
     '''
     txt = open("deprecate_acq.txt", "r")
-    for acq in txt:
-        acq_id = acq.strip()
-        update_document(_id=acq_id)
+    acq_ids = [acq.strip() for acq in txt if acq.strip()]
+    doc_indices = get_document_indices(acq_ids)
+    for acq_id in acq_ids:
+        if acq_id not in doc_indices:
+            logger.warning("%s not found in %s. Skipping..." % (acq_id, ACQ_INDEX))
+            continue
+        for index in doc_indices[acq_id]:
+            update_document(_id=acq_id, index=index)
 
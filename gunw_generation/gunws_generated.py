@@ -2,7 +2,11 @@
 Determines the number of gunws generated over an AOI for a given time range.
 '''
 import argparse
+import os
+import json
+import time
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 from elasticsearch import Elasticsearch
 import datetime
 from dateutil.relativedelta import relativedelta
@@ -10,25 +14,78 @@ import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+AOI_INDEX = "grq_*_area_of_interest"
+GUNW_INDEX = "grq_*_s1-gunw"
+INDEX_CACHE_FILE = "es_index_cache.json"
+INDEX_CACHE_TTL = 3600 # seconds
+MAX_THREADS = 8
+
 def connect_to_host():
     grq = Elasticsearch(GRQ_URL, verify_certs=False)
     if not grq.ping():
         return 1
     return grq
 
+def resolveIndices(index_pattern):
+    # resolve the pattern to the open indices holding documents, cached for INDEX_CACHE_TTL seconds
+    if "*" not in index_pattern and "," not in index_pattern: # concrete index or alias, nothing to resolve
+        return [index_pattern]
+    key = GRQ_URL + "|" + index_pattern
+    cache = loadJSON(INDEX_CACHE_FILE)
+    cached = cache.get(key)
+    if cached is not None and time.time() - cached.get("time", 0) < INDEX_CACHE_TTL:
+        return cached.get("indices")
+    stats = grq.indices.stats(index=index_pattern, metric="docs", expand_wildcards="open").get("indices", {})
+    indices = sorted([index for index, stat in stats.items() if stat.get("primaries", {}).get("docs", {}).get("count", 0) > 0])
+    if not indices: # nothing to narrow down to, let ES resolve the pattern
+        indices = [index_pattern]
+    cache[key] = {"time": time.time(), "indices": indices}
+    writeJSON(INDEX_CACHE_FILE, cache)
+    return indices
+
+def loadJSON(json_file):
+    # a missing or unreadable file is treated as empty
+    try:
+        with open(json_file, "r") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def writeJSON(json_file, data):
+    # write through a temp file so an interrupted write never leaves it truncated
+    tmp_file = "%s.%d.tmp" % (json_file, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, json_file)
+
+def searchIndices(index_pattern, **kwargs):
+    # run the search over each resolved index in parallel and merge the hits
+    indices = resolveIndices(index_pattern)
+    if len(indices) == 1:
+        return grq.search(index=indices[0], **kwargs)['hits']['hits']
+    pool = ThreadPool(min(len(indices), MAX_THREADS))
+    try:
+        results = pool.map(lambda index: grq.search(index=index, **kwargs), indices)
+    finally:
+        pool.close()
+    return [hit for res in results for hit in res['hits']['hits']]
+
 def validateAOIs(aois):
     aoi_list = []
     if aois != "all":
         aoi_list = aois.split(",")
-        for aoi in aoi_list:
-            if not grq.exists(index="grq_v3.0_area_of_interest", doc_type="area_of_interest", id=aoi):
+        doc = {"query":{"ids":{"values":aoi_list}}}
+        found = set(hit["_id"] for hit in searchIndices(AOI_INDEX, doc_type="area_of_interest", body=doc, size=len(aoi_list)))
+        for aoi in list(aoi_list):
+            if aoi not in found:
                 print("WARNING: %s does not exist. Skipping..." % aoi)
                 aoi_list.remove(aoi)
     else: # pull all aoi id's from grq
         print("Querying over all AOI's...")
-        res = grq.search(index="grq_v3.0_area_of_interest", doc_type="area_of_interest", size=1000)
-        for doc in res['hits']['hits']:
-            aoi_list.append(doc["_id"])
+        for doc in searchIndices(AOI_INDEX, doc_type="area_of_interest", size=1000):
+            if doc["_id"] not in aoi_list: # the same aoi can be in more than one index version
+                aoi_list.append(doc["_id"])
     return aoi_list
 
 def getTimeRange(time):
@@ -52,11 +109,15 @@ def getGUNWCounts(aoi_list, start_time):
         aoi_query = aoi_query + aoi + " OR "
     aoi_query = aoi_query[:-4]
     doc = {"query":{"bool":{"must":[{"range":{"creation_timestamp":{"gt":start_time,"lt":"now"}}},{"query_string":{"default_field":"metadata.tags.raw","query": aoi_query}}]}},"from":0,"sort":[],"aggs":{}}
-    res = grq.search(index="grq_v2.0.3_s1-gunw", body=doc)
     # for each result, look at tags, create dict of tag: gunwid
-    for hit in res['hits']['hits']:
-        tag_list = hit["_source"]["metadata"]["tags"]
+    # a gunw can be in more than one index version, only count it once
+    seen = set()
+    for hit in searchIndices(GUNW_INDEX, body=doc):
         gunw_id = hit["_id"]
+        if gunw_id in seen:
+            continue
+        seen.add(gunw_id)
+        tag_list = hit["_source"]["metadata"]["tags"]
         for tag in tag_list:
             tags[tag].append(gunw_id)
     printTags(tags)
@@ -91,6 +152,8 @@ if __name__ == '__main__':
     parser.add_argument('--aoi', "--aoi", default="all", help='AOIs from which to query gunws [default searches all AOIs]')
     parser.add_argument('--verbose', action='store_true', help='Prints the gunw ids. Without it, only the numbers will be printed.')
     parser.add_argument('--time', "--time", default="1d", help='Time range over which to look at to report gunw generation.')
+    parser.add_argument('--aoi_index', default=AOI_INDEX, help='AOI index or pattern [default searches all AOI index versions]')
+    parser.add_argument('--gunw_index', default=GUNW_INDEX, help='GUNW index or pattern [default searches all GUNW index versions, counting each id once]')
 
     # Connection parameters
     #GRQ_URL = 'https://100.67.35.28/es/'
@@ -104,6 +167,8 @@ if __name__ == '__main__':
         print("Connected to GRQ")
 
     args = parser.parse_args()
+    AOI_INDEX = args.aoi_index
+    GUNW_INDEX = args.gunw_index
     aoi_list = validateAOIs(args.aoi)
     start_time = getTimeRange(args.time)
 